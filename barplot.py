@@ -3,12 +3,14 @@
 from __future__ import division
 import sys
 import numpy
+import logging
 import argparse
 import collections
 import matplotliblib
 import munger
 
 OPT_DEFAULTS = {'label_field':1, 'data_field':2, 'bar_width':0.75}
+BUFFER_SIZE = 65536
 USAGE = """cat file.txt | %(prog)s [options]
        %(prog)s [options] file.txt"""
 DESCRIPTION = """Display a quick bar plot of the input data, using matplotlib.
@@ -48,21 +50,49 @@ def main(argv):
   plotter.add_arguments(parser, groups)
   args = parser.parse_args(argv[1:])
 
+  logging.basicConfig(filename=args.log, filemode='w', level=args.volume, format='%(message)s')
+
   if args.file:
-    input_stream = open(args.file, 'rU')
+    input_stream = open(args.file, buffering=BUFFER_SIZE)
   else:
     input_stream = sys.stdin
 
+  labels, values = read_data(input_stream, args.label_field, args.data_field, args.tab)
+
+  xlocations = numpy.arange(len(labels))
+  width = args.bar_width * len(labels) / 5
+
+  # make the actual plot
+  axes = plotter.preplot(args)
+  axes.bar(xlocations, values, width, color=args.color)
+  plotter.set_ticks(xlocations + width/2, labels, axis='x')
+  plotter.plot(args)
+
+
+def read_data(input_stream, label_field, data_field, tab):
+  """Read the labels and values from the input.
+  Tries to parse the whole input at once with munger.parse_str_columns(), falling back to going line
+  by line (which gives per-line warnings) if anything about the input is irregular."""
+  lines = input_stream.readlines()
+  if not lines:
+    return [], []
+  parsed = munger.parse_str_columns(lines, (data_field,), (label_field,), tab)
+  if parsed is not None:
+    data, (labels,) = parsed
+    return labels.tolist(), data[:,0]
+  return read_data_lines(lines, label_field, data_field, tab)
+
+
+def read_data_lines(lines, label_field, data_field, tab):
   labels = []
   values = []
   line_num = 0
-  integers = True
-  for line in input_stream:
+  for line in lines:
     line_num+=1
     (label, value_str) = munger.get_fields(
       line,
-      fields=(args.label_field, args.data_field),
-      tab=args.tab,
+      fields=(label_field, data_field),
+      tab=tab,
       errors='warn'
     )
     if label is None or value_str is None:
@@ -75,15 +105,7 @@ def main(argv):
       continue
     labels.append(label)
     values.append(value)
-
-  xlocations = numpy.arange(len(labels))
-  width = args.bar_width * len(labels) / 5
-
-  # make the actual plot
-  axes = plotter.preplot(**vars(args))
-  axes.bar(xlocations, values, width, color=args.color)
-  plotter.set_ticks(xlocations + width/2, labels, axis='x')
-  plotter.plot(**vars(args))
+  return labels, values
 
 
 if __name__ == '__main__':
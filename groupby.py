@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 import sys
 import argparse
+import array
 import collections
+import operator
 import munger
-# also imports numpy, if certain summary methods are selected
+# also imports numpy, if the median summary method is selected
 
 DESCRIPTION = """Take a set of labeled values in a text file and group them by
 the labels. By default, it will print the sum of the values for each label."""
-EPILOG = """Caution: It holds the entire dataset in memory."""
+EPILOG = """Caution: With the median, csv, and tsv summary methods or --summary-method-eval, it
+holds the entire dataset in memory."""
 USAGE = """cat file.txt | %(prog)s [options]
        %(prog)s [options] file.txt"""
 OPT_DEFAULTS = {'label_field':1, 'data_field':2, 'method':'total'}
+# Summary methods which can be computed with a running accumulator, without storing every value.
+STREAM_METHODS = ('total', 'max', 'min', 'average')
+REDUCERS = {'total':operator.add, 'max':max, 'min':min}
+BUFFER_SIZE = 65536
 
 def main(argv):
 
@@ -34,10 +41,11 @@ def main(argv):
   parser.add_argument('-m', '--summary-method', dest='method',
     choices=('total', 'count', 'max', 'min', 'average', 'median', 'tsv', 'csv'),
     help='A method of summarizing the list of numbers under each label. Notes: '
-      '"count" is just the number of occurrences of the label. "csv" just '
+      '"count" is just the number of occurrences of the label (the data column '
+      'is not read). "csv" just '
       'joins all the values with commas and prints that, effectively just '
-      'collating them by label. "tsv" does the same, but with tabs. "average" '
-      'and "median" require numpy.'
+      'collating them by label. "tsv" does the same, but with tabs. "median" '
+      'requires numpy. '
       'Default: %(default)s.')
   parser.add_argument('-M', '--summary-method-eval', dest='method_eval',
     help='Literal code for the summary method. This will be eval\'d and used '
@@ -50,20 +58,50 @@ def main(argv):
   args = parser.parse_args(argv[1:])
 
   if args.file:
-    input_stream = open(args.file, 'rU')
+    input_stream = open(args.file, buffering=BUFFER_SIZE)
   else:
     input_stream = sys.stdin
 
-  # Read data into dict, mapping values in the label column to values in the
-  # data column (if they can be parsed to ints or floats).
-  data = collections.OrderedDict()
+  if args.method == 'count' and not args.method_eval:
+    # Counting doesn't need the values at all, so only the label column is read.
+    labels = read_labels(input_stream, args.label_field, args.tab)
+    summaries = collections.Counter(labels)
+  elif args.method in STREAM_METHODS and not args.method_eval:
+    pairs = read_values(input_stream, args.label_field, args.data_field, args.tab)
+    summaries = stream_summaries(pairs, args.method)
+  else:
+    pairs = read_values(input_stream, args.label_field, args.data_field, args.tab)
+    summaries = group_summaries(pairs, args.method, args.method_eval)
+
+  if args.out_file:
+    output_stream = open(args.out_file, 'w')
+  else:
+    output_stream = sys.stdout
+
+  for (label, summary) in summaries.items():
+    output_stream.write("{}\t{}\n".format(label, summary))
+
+  output_stream.close()
+
+
+def read_labels(input_stream, label_field, tab):
+  """Yield the label from each line of the input which has one."""
+  for line in input_stream:
+    label = munger.get_field(line, field=label_field, tab=tab, errors='warn')
+    if label is not None:
+      yield label
+
+
+def read_values(input_stream, label_field, data_field, tab):
+  """Yield (label, value) pairs from the input, where the value has been parsed to an int or
+  float. Lines without both fields or with a non-number value are skipped with a warning."""
   line_num = 0
   for line in input_stream:
     line_num+=1
     (label, value_str) = munger.get_fields(
       line,
-      fields=(args.label_field, args.data_field),
-      tab=args.tab,
+      fields=(label_field, data_field),
+      tab=tab,
       errors='warn'
     )
     if label is None or value_str is None:
@@ -74,55 +112,69 @@ def main(argv):
       sys.stderr.write('Warning: Non-number encountered on line %d:\n%s\n' %
         (line_num, line.rstrip('\r\n')))
       continue
-    values = data.get(label, [])
-    values.append(value)
-    data[label] = values
+    yield label, value
+
 
-  if args.method_eval:
+def stream_summaries(pairs, method):
+  """Summarize the values under each label in a single pass, using a running accumulator instead
+  of holding all the values in memory. Only works for the methods in STREAM_METHODS."""
+  # Note: This relies on dicts preserving insertion order (Python 3.7+) to output the labels in the
+  # order they were first seen.
+  summaries = {}
+  if method == 'average':
+    counts = {}
+    for (label, value) in pairs:
+      summaries[label] = summaries.get(label, 0) + value
+      counts[label] = counts.get(label, 0) + 1
+    for (label, count) in counts.items():
+      summaries[label] /= count
+  else:
+    reducer = REDUCERS[method]
+    for (label, value) in pairs:
+      if label in summaries:
+        summaries[label] = reducer(summaries[label], value)
+      else:
+        summaries[label] = value
+  return summaries
+
+
+def group_summaries(pairs, method, method_eval=None):
+  """Collect all the values under each label, then summarize each list of values."""
+  # Read data into dict, mapping values in the label column to values in the
+  # data column.
+  # The numpy-based methods get packed arrays of doubles, which numpy can read without a copy.
+  if method == 'median' and not method_eval:
+    data = collections.defaultdict(lambda: array.array('d'))
+  else:
+    data = collections.defaultdict(list)
+  for (label, value) in pairs:
+    data[label].append(value)
+
+  if method_eval:
     try:
-      summary_fxn = eval(args.method_eval)
+      summary_fxn = eval(method_eval)
     except Exception:
       sys.stderr.write('Error: Given eval code led to a parsing error. '
         'Full traceback below:\n\n')
       raise
-  elif args.method == 'total':
-    summary_fxn = sum
-  elif args.method == 'count':
-    summary_fxn = len
-  elif args.method == 'max':
-    summary_fxn = max
-  elif args.method == 'min':
-    summary_fxn = min
-  elif args.method == 'csv':
+  elif method == 'csv':
     summary_fxn = lambda x: ','.join(map(str, x))
-  elif args.method == 'tsv':
+  elif method == 'tsv':
     summary_fxn = lambda x: '\t'.join(map(str, x))
-  elif args.method == 'average':
-    import numpy
-    summary_fxn = numpy.mean
-  elif args.method == 'median':
+  elif method == 'median':
     import numpy
-    summary_fxn = numpy.median
+    summary_fxn = lambda x: numpy.median(numpy.frombuffer(x))
 
   summaries = collections.OrderedDict()
   for (label, values) in data.items():
     try:
       summaries[label] = summary_fxn(values)
     except Exception:
-      if args.method_eval:
+      if method_eval:
         sys.stderr.write('Error: Given eval code led to a runtime error. '
           'Full traceback below:\n\n')
       raise
-
-  if args.out_file:
-    output_stream = open(args.out_file, 'w')
-  else:
-    output_stream = sys.stdout
-
-  for (label, summary) in summaries.items():
-    output_stream.write("{}\t{}\n".format(label, summary))
-
-  output_stream.close()
+  return summaries
 
 
 def fail(message):
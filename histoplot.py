@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
+import os
 import sys
+import array
 import logging
 import argparse
+import numpy
 import matplotliblib
 import munger
 
 DEFAULT_BINS = 20
+BUFFER_SIZE = 65536
+# Output file extensions which get the histogram counts written as data instead of a plot.
+RAW_DELIMITERS = {'.tsv':'\t', '.txt':'\t', '.csv':','}
+RAW_FORMATS = tuple(RAW_DELIMITERS.keys()) + ('.npy',)
 OPT_DEFAULTS = {'x_label':'Value', 'y_label':'Frequency'}
 USAGE = """cat file.txt | %(prog)s [options]
        %(prog)s [options] file.txt"""
 DESCRIPTION = """Display a quick histogram of the input data, using matplotlib.
 """
-EPILOG = """Caution: It holds the entire dataset in memory, as a list."""
+EPILOG = """If the --out-file ends in {}, the histogram counts will be written to it
+instead of a plot, one line per bin: the lower bin edge, the upper bin edge, and the count. The .npy
+format is a numpy array of the same. Caution: It holds the entire dataset in memory."""
+EPILOG = EPILOG.format(', '.join(RAW_FORMATS))
 
 
 def make_parser():
@@ -21,7 +31,8 @@ def make_parser():
   parser.set_defaults(**OPT_DEFAULTS)
   input = parser.add_argument_group('Input')
   groups['input'] = input
-  input.add_argument('input', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+  input.add_argument('input', nargs='?', type=argparse.FileType('r', bufsize=BUFFER_SIZE),
+    default=sys.stdin,
     help='Data file. If omitted, data will be read from stdin. Each line '
       'should contain one number.')
   input.add_argument('-f', '--field', type=int, default=1,
@@ -43,6 +54,9 @@ def make_parser():
     help='Range of the bins only. This will be used when calculating the size '
       'of the bins (unless -B is given), but it won\'t affect the scaling of '
       'the X axis. Give the lower bound, then the upper.')
+  binning.add_argument('--print-counts', action='store_true',
+    help='Print the histogram counts to stdout instead of plotting. Prints one tab-delimited line '
+      'per bin: the lower bin edge, the upper bin edge, and the count.')
   return parser
 
 
@@ -54,12 +68,15 @@ def main(argv):
   plotter.add_arguments(parser)
   args = parser.parse_args(argv[1:])
 
-  logging.basicConfig(stream=args.log, level=args.volume, format='%(message)s')
+  logging.basicConfig(filename=args.log, filemode='w', level=args.volume, format='%(message)s')
+
+  if args.input is sys.stdin:
+    # Read stdin through a bigger buffer than the default, so it takes fewer read() calls.
+    args.input = open(sys.stdin.fileno(), buffering=BUFFER_SIZE, closefd=False)
 
   data, top, bottom = read_data(args.input, args.field, args.tab)
 
-  if args.input is not sys.stdin:
-    args.input.close()
+  args.input.close()
 
   if len(data) == 0:
     logging.info('No data.')
@@ -68,30 +85,62 @@ def main(argv):
   bins, bin_range = get_edges(args.bins, args.bin_edges, args.bin_range, args.range, args.unity,
                               top, bottom)
 
+  # No need for matplotlib at all if we're just outputting the counts.
+  if args.print_counts:
+    counts, edges = numpy.histogram(data, bins=bins, range=bin_range)
+    write_counts(sys.stdout, counts, edges)
+    return
+  elif args.out_file and os.path.splitext(args.out_file)[1].lower() in RAW_FORMATS:
+    counts, edges = numpy.histogram(data, bins=bins, range=bin_range)
+    save_counts(args.out_file, counts, edges)
+    return
+
   make_plot(plotter, data, args, bins, bin_range)
 
 
 def read_data(input, field, tab):
-  # read data into list, parse types into ints or skipping if not possible
-  data = []
-  top = -sys.maxsize
-  bottom = sys.maxsize
-  line_num = 0
-  for line in input:
-    line_num+=1
-    value = munger.get_field(line, field=field, tab=tab, cast=True, errors='warn')
-    if value < bottom:
-      bottom = value
-    if value > top:
-      top = value
-    data.append(value)
-  return data, top, bottom
+  # Try parsing everything at once first, and only go line by line if the input is irregular.
+  data = munger.parse_file_columns(input, (field,), tab)
+  if data is None:
+    lines = input.readlines()
+    data = munger.parse_columns(lines, (field,), tab)
+  if data is None:
+    data = read_data_lines(lines, field, tab)
+  else:
+    data = data[:,0]
+  if len(data) == 0:
+    return data, -sys.maxsize, sys.maxsize
+  return data, data.max(), data.min()
+
+
+def read_data_lines(lines, field, tab):
+  # read data into a packed array of doubles, skipping values that can't be parsed
+  data = array.array('d')
+  # Bind these to locals to avoid the global and attribute lookups on every line.
+  get_field = munger.get_field
+  to_num = munger.to_num
+  append = data.append
+  index = field - 1
+  if tab:
+    sep = '\t'
+  else:
+    sep = None
+  for line in lines:
+    # Parse the common case inline. Only lines with problems go through munger, to get the warning.
+    # (No need to strip the newline: to_num() ignores surrounding whitespace.)
+    try:
+      append(to_num(line.split(sep)[index]))
+    except (IndexError, ValueError):
+      get_field(line, field, tab, True, 'warn')
+  return numpy.frombuffer(data)
 
 
 def get_edges(bins_arg, bin_edges, bin_range_arg, range_arg, unity, top, bottom):
   # Compute plot settings from arguments
   if bin_edges:
-    bins = bin_edges
+    bins = numpy.array(bin_edges, dtype=numpy.float64)
+    if numpy.any(bins[1:] < bins[:-1]):
+      fail('Error: --bin-edges must be given in increasing order.')
   elif bins_arg:
     bins = bins_arg
   else:
@@ -107,26 +156,49 @@ def get_edges(bins_arg, bin_edges, bin_range_arg, range_arg, unity, top, bottom)
              .format(bins_arg, bin_range_arg[0], bin_range_arg[1]))
       else:
         bin_range = (bottom-0.5, bottom+bins_arg+0.5)
-        print('Saw --bins {}, using --bins {} --bin-range {} {}.'
-              .format(bins_arg, bins, bin_range[0], bin_range[1]))
+        logging.warning('Saw --bins {}, using --bins {} --bin-range {} {}.'
+                        .format(bins_arg, bins, bin_range[0], bin_range[1]))
     else:
       if bin_range_arg:
-        bins = bin_range_arg[1] - bin_range_arg[0] + 1
+        bins = int(bin_range_arg[1] - bin_range_arg[0] + 1)
         bin_range = (bin_range_arg[0]-0.5, bin_range_arg[1]+0.5)
       else:
-        bins = top - bottom + 1
+        bins = int(top - bottom + 1)
         bin_range = (bottom-0.5, top+0.5)
         if bins > 200:
           fail('Error: Range of data is {}. Using that many bins will be hard to read. If you '
                'really want that many, please provide it explicitly to --bins.'.format(bins))
+  if bin_range is None and not bin_edges:
+    # This is the range numpy would use by default, but it'd have to make another pass over the
+    # data to find the min and max. We already found them while reading it.
+    bin_range = (bottom, top)
   return bins, bin_range
 
 
 def make_plot(plotter, data, args, bins, bin_range):
   # make the actual plot
-  axes = plotter.preplot(**vars(args))
-  axes.hist(data, bins=bins, range=bin_range, color=args.color)
-  plotter.plot(**vars(args))
+  counts, edges = numpy.histogram(data, bins=bins, range=bin_range)
+  axes = plotter.preplot(args)
+  # Plot the precomputed counts by giving each bin a single point, weighted by its count.
+  axes.hist(edges[:-1], bins=edges, weights=counts, color=args.color)
+  plotter.plot(args)
+
+
+def save_counts(out_file, counts, edges):
+  ext = os.path.splitext(out_file)[1].lower()
+  if ext == '.npy':
+    numpy.save(out_file, numpy.column_stack((edges[:-1], edges[1:], counts)))
+  else:
+    with open(out_file, 'w') as output:
+      write_counts(output, counts, edges, delimiter=RAW_DELIMITERS[ext])
+
+
+def write_counts(output, counts, edges, delimiter='\t'):
+  # Round the edges to 12 significant digits, so floating point error like 2.4000000000000004 doesn't
+  # show up, but unix timestamps are still exact to fractions of a second.
+  lines = ['{:.12g}{delim}{:.12g}{delim}{}\n'.format(lower, upper, count, delim=delimiter)
+           for lower, upper, count in zip(edges[:-1], edges[1:], counts)]
+  output.write(''.join(lines))
 
 
 def fail(message):
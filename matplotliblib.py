@@ -3,16 +3,63 @@ import argparse
 import logging
 import os
 import sys
-import matplotlib
+# matplotlib is only imported once it's needed, in preplot(), so that things like --help and input
+# errors don't have to wait for it to load.
 
-# Prevent script from failing on headless machines with no X session:
-# https://stackoverflow.com/questions/4706451/how-to-save-a-figure-remotely-with-pylab/4706614#4706614
-if not os.getenv('DISPLAY'):
-  matplotlib.use('Agg')
+DEFAULTS = {'dpi':80, 'width':640, 'height':480}
+WIDTH_HELP = ('Width of the output image, in pixels. The default aspect ratio will be maintained '
+              'unless --height is also given. Default: {width}px.'.format(**DEFAULTS))
+HEIGHT_HELP = ('Height of the output image, in pixels. The default aspect ratio will be maintained '
+               'unless --width is also given. Default: {height}px.'.format(**DEFAULTS))
+_pyplot = None
 
-import matplotlib.pyplot
 
-DEFAULTS = {'dpi':80, 'width':640, 'height':480}
+def _get_pyplot(backend=None):
+  """Import matplotlib.pyplot, selecting the backend the first time."""
+  global _pyplot
+  if _pyplot is None:
+    import matplotlib
+    if backend:
+      matplotlib.use(backend)
+    # Prevent script from failing on headless machines with no X session:
+    # https://stackoverflow.com/questions/4706451/how-to-save-a-figure-remotely-with-pylab/4706614#4706614
+    elif not os.getenv('DISPLAY'):
+      matplotlib.use('Agg')
+    import matplotlib.pyplot
+    _pyplot = matplotlib.pyplot
+  return _pyplot
+
+
+def _check_file_backend(backend, out_file):
+  """Check whether the matplotlib "backend" can save "out_file", judging by its extension.
+  Returns an error message if it can't, or None if it can."""
+  import importlib
+  import matplotlib
+  ext = os.path.splitext(out_file)[1]
+  if ext:
+    file_format = ext[1:].lower()
+  else:
+    file_format = matplotlib.rcParams['savefig.format']
+  if backend.startswith('module://'):
+    module_name = backend[len('module://'):]
+  else:
+    module_name = 'matplotlib.backends.backend_'+backend.lower()
+  try:
+    canvas_class = importlib.import_module(module_name).FigureCanvas
+  except (ImportError, AttributeError) as error:
+    return 'Error: Could not load --mpl-backend {!r}: {}'.format(backend, error)
+  if getattr(canvas_class, 'required_interactive_framework', None):
+    return ('Error: --mpl-backend {!r} is a GUI backend, which can\'t save files. Use a file '
+            'renderer like "agg", or leave it out.'.format(backend))
+  # This is how Figure.savefig() itself decides whether a backend can write the format.
+  if not hasattr(canvas_class, 'print_'+file_format):
+    return 'Error: --mpl-backend {!r} can\'t write {} files.'.format(backend, file_format)
+  return None
+
+
+def fail(message):
+  logging.critical(message)
+  sys.exit(1)
 
 
 class PlotHelper(object):
@@ -22,6 +69,7 @@ class PlotHelper(object):
     self.axes = None
     self.dpi = None
     self.figsize = None
+    self.reusable = False
 
   def _get_or_add_argument_group(self, parser, group_name, group_title, existing_groups):
     if group_name in existing_groups:
@@ -58,19 +106,29 @@ class PlotHelper(object):
       help='Show gridlines.')
     image = self._get_or_add_argument_group(parser, 'image', 'Image output', groups)
     image.add_argument('-W', '--width', type=int,
-      help='Width of the output image, in pixels. The default aspect ratio will be maintained '
-        'unless --height is also given. Default: {width}px.'.format(**DEFAULTS))
+      help=WIDTH_HELP)
     image.add_argument('-H', '--height', type=int,
-      help='Height of the output image, in pixels. The default aspect ratio will be maintained '
-        'unless --height is also given. Default: {height}px.'.format(**DEFAULTS))
+      help=HEIGHT_HELP)
     image.add_argument('-F', '--feature-scale', type=float, default=1,
       help='Change the size of the features in the image. Increase this value to make the text, '
         'lines, points, etc. larger. Default: %(default)s')
     image.add_argument('-o', '--out-file', metavar='OUTPUT_FILE',
       help='Save the plot to this file instead of displaying it. The image '
         'format will be inferred from the file extension.')
+    image.add_argument('--mpl-backend', metavar='BACKEND',
+      help='The matplotlib backend to use. When saving to a file, this is the renderer, and it has '
+        'to support the file\'s extension: "agg" writes png, jpg, tif, gif and webp, "pdf" writes '
+        'pdf, "svg" writes svg, "ps" writes ps and eps, "pgf" writes pgf, pdf and png, and "cairo" '
+        '(if installed) writes png, pdf, ps, eps and svg. GUI backends can\'t save files. The '
+        'default is to pick the renderer from the extension, without any GUI toolkit. When '
+        'displaying the plot, this is the GUI backend (e.g. "TkAgg" or "QtAgg"). The default is '
+        'matplotlib\'s default, or "agg" if there\'s no $DISPLAY.')
+    image.add_argument('--rasterize-data', action='store_true',
+      help='When saving to a vector format (PDF, SVG, etc), render the plotted data (points, '
+        'lines, bars) as a bitmap, keeping the axes, labels, and text as vectors. Makes files with '
+        'many data points much smaller and faster to write and display.')
     log = self._get_or_add_argument_group(parser, 'log', 'Logging', groups)
-    log.add_argument('-L', '--log', type=argparse.FileType('w'), default=sys.stderr,
+    log.add_argument('-L', '--log',
       help='Print log messages to this file instead of to stderr. Warning: Will overwrite the file.')
     volume = log.add_mutually_exclusive_group()
     volume.add_argument('-q', '--quiet', dest='volume', action='store_const', const=logging.CRITICAL,
@@ -92,7 +150,7 @@ class PlotHelper(object):
   def scale(self, defaults=DEFAULTS, **args):
     """Calculate the correct dpi and figsize to scale the image as the user
     requested.
-    Required keyword arguments: 'dpi', 'width', 'height'
+    Required keyword arguments: 'feature_scale', 'width', 'height'
     """
     # Note: At least when generating PNGs, "dpi" basically means pixels per inch, and figsize
     # is measured in inches. So a figsize (8, 6) image with a 180 dpi will be 8*180 = 1440px wide
@@ -105,87 +163,118 @@ class PlotHelper(object):
     )
     # Figure out the pixel width and height of the image, maintaining the default aspect ratio
     # unless explicitly requested to do otherwise.
-    default_aspect_ratio = defaults['width'] / defaults['height']
-    if args['width'] is None:
-      if args['height'] is None:
-        width = defaults['width']
-      else:
-        width = args['height'] * default_aspect_ratio
-    else:
-      width = args['width']
-    if args['height'] is None:
-      if args['width'] is None:
-        height = defaults['height']
-      else:
-        height = args['width'] / default_aspect_ratio
-    else:
-      height = args['height']
-    image_scale = min(width/defaults['width'], height/defaults['height'])
+    default_width = defaults['width']
+    default_height = defaults['height']
+    width = args['width']
+    height = args['height']
+    if width is None and height is None:
+      width = default_width
+      height = default_height
+    elif width is None:
+      width = height * (default_width / default_height)
+    elif height is None:
+      height = width / (default_width / default_height)
+    image_scale = min(width/default_width, height/default_height)
     self.dpi = defaults['dpi'] * args['feature_scale'] * image_scale
     self.figsize = (width/self.dpi, height/self.dpi)
     return self.dpi, self.figsize
 
   def set_ticks(self, tick_values, tick_labels, axis='x'):
     if axis.lower() == 'x':
-      self.axes.set_xticks(tick_values)
-      self.axes.set_xticklabels(tick_labels)
+      self.axes.set_xticks(tick_values, tick_labels)
     elif axis.lower() == 'y':
       self.axes.set_yticks(tick_values, tick_labels)
-      self.axes.set_yticklabels(tick_labels)
 
-  def preplot(self, **args):
-    """Set up the initial pyplot figure parameters, return an Axes object.
-    Run this, get pyplot from it, and create your plot with it. E.g.:
-      axes = matplotliblib.preplot(**vars(args))
+  def preplot(self, args=None, **kwargs):
+    """Create the Figure and its Axes, sized by the options, and return the Axes.
+    Draw your plot on the Axes it returns, then call plot(). E.g.:
+      axes = plotter.preplot(args)
       axes.hist(data)
-    Required keyword arguments: 'dpi', 'width', 'height'
+    "args" is the argparse Namespace. Required attributes: 'feature_scale', 'width', 'height',
+    'out_file'
+    The options can also be given as keyword arguments instead of a Namespace.
+    With an 'out_file', the Figure is a standalone one with an Agg canvas and pyplot isn't used.
+    Otherwise, it's made with pyplot (using the 'mpl_backend', if given), so plot() can show it.
+    The Figure is kept in self.figure. A saved Figure can be drawn into again after reset().
     """
-    self.scale(**args)
+    if args is None:
+      args = argparse.Namespace(**kwargs)
+    backend = getattr(args, 'mpl_backend', None)
+    if args.out_file and backend:
+      error = _check_file_backend(backend, args.out_file)
+      if error:
+        fail(error)
+    self.scale(feature_scale=args.feature_scale, width=args.width, height=args.height)
     logging.debug("dpi: {}, figsize: {}".format(self.dpi, self.figsize))
-    # Note: We can avoid pyplot with matplotlib.figure.Figure() instead, but then we need to configure
-    # the backend manually. Example: https://matplotlib.org/gallery/api/agg_oo_sgskip.html
-    self.figure = matplotlib.pyplot.figure(dpi=self.dpi, figsize=self.figsize)
+    if args.out_file:
+      # When just saving to a file, we don't need pyplot and its global state. We can render with
+      # the Agg backend directly. Example: https://matplotlib.org/gallery/api/agg_oo_sgskip.html
+      import matplotlib.figure
+      import matplotlib.backends.backend_agg
+      self.figure = matplotlib.figure.Figure(dpi=self.dpi, figsize=self.figsize)
+      matplotlib.backends.backend_agg.FigureCanvasAgg(self.figure)
+    else:
+      pyplot = _get_pyplot(getattr(args, 'mpl_backend', None))
+      self.figure = pyplot.figure(dpi=self.dpi, figsize=self.figsize)
     #TODO: Extra features:
     # figure.suptitle('Super title for entire plot', fontsize=22)
     # figure.set_figwidth(14)
     self.axes = self.figure.add_subplot(1, 1, 1)
+    self.reusable = bool(args.out_file)
+    return self.axes
+
+  def reset(self):
+    """Clear the Axes so the Figure can be drawn into and saved again, and return the Axes.
+    This is cheaper than another preplot() when saving many plots of the same size in a row, e.g.:
+      axes = plotter.preplot(args)
+      for path, data in plots:
+        axes.hist(data)
+        args.out_file = path
+        plotter.plot(args)
+        axes = plotter.reset()
+    Only for Figures made with an 'out_file': a displayed Figure is closed by plot()."""
+    if not self.reusable:
+      raise RuntimeError('reset() only works on a Figure that preplot() made with an out_file.')
+    self.axes.clear()
     return self.axes
 
-  def plot(self, **args):
+  def plot(self, args=None, **kwargs):
     """Add options to a plot, and either display it or save it.
-    Create your plot, then give the Axes object to this function, e.g.:
+    Create your plot, then give the argparse Namespace to this function, e.g.:
       axes.hist(data)
-      matplotliblib.plot(axes, **vars(args))
-    Required argparse arguments:
-    'x_label', 'y_label', 'title', 'out_file'
+      plotter.plot(args)
+    Required attributes: 'x_label', 'y_label', 'title', 'grid', 'out_file'
+    The options can also be given as keyword arguments instead of a Namespace.
     """
-    required_opts = ('x_label', 'y_label', 'title', 'out_file')
-    missing_opts = [opt for opt in required_opts if opt not in args]
-    assert len(missing_opts) == 0, (
-      'Necessary command-line arguments are missing: '+', '.join(missing_opts)
-    )
-
+    if args is None:
+      args = argparse.Namespace(**kwargs)
     # Set X and Y ranges.
-    if args.get('range') is not None:
-      args['x_range'] = args['range']
-      args['y_range'] = args['range']
-    if args.get('x_range') is not None:
-      self.axes.set_xlim(*args['x_range'])
-    if args.get('y_range') is not None:
-      self.axes.set_ylim(*args['y_range'])
+    x_range = getattr(args, 'x_range', None)
+    y_range = getattr(args, 'y_range', None)
+    if getattr(args, 'range', None) is not None:
+      x_range = y_range = args.range
+    if x_range is not None:
+      self.axes.set_xlim(*x_range)
+    if y_range is not None:
+      self.axes.set_ylim(*y_range)
 
     # Apply rest of settings
-    self.axes.set_xlabel(args['x_label'])
-    self.axes.set_ylabel(args['y_label'])
-    if args['title']:
-      self.axes.set_title(args['title'])
-    if args['grid']:
+    self.axes.set_xlabel(args.x_label)
+    self.axes.set_ylabel(args.y_label)
+    if args.title:
+      self.axes.set_title(args.title)
+    if args.grid:
       self.axes.grid()
-    if not args.get('no_tight'):
-      matplotlib.pyplot.tight_layout()
+    if not getattr(args, 'no_tight', False):
+      self.figure.tight_layout()
     # Display or save
-    if args['out_file']:
-      matplotlib.pyplot.savefig(args['out_file'])
+    if args.out_file:
+      if getattr(args, 'rasterize_data', False):
+        for artists in (self.axes.collections, self.axes.lines, self.axes.patches):
+          for artist in artists:
+            artist.set_rasterized(True)
+      self.figure.savefig(args.out_file, backend=getattr(args, 'mpl_backend', None))
     else:
-      matplotlib.pyplot.show()
-    matplotlib.pyplot.close()
+      pyplot = _get_pyplot()
+      pyplot.show()
+      pyplot.close(self.figure)
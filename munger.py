@@ -1,5 +1,15 @@
 #!/usr/bin/env python3
+import io
+import os
+import csv
+import math
+import stat
 import logging
+import warnings
+try:
+  from fastnumbers import try_real
+except ImportError:
+  try_real = None
 NON_NUMBERS = (float('inf'), float('nan'))
 
 
@@ -20,7 +30,7 @@ def get_field(line, field=None, tab=False, cast=False, errors='silent'):
   # try to pull out requested field
   value = deindex_or_error(fields, field-1, errors, line=line)
   # try to cast value, if requested
-  if cast:
+  if cast and value is not None:
     value = cast_or_error(value, errors, line=line)
   return value
 
@@ -55,6 +65,179 @@ def get_fields(line, fields=None, tab=False, casts=None, errors='silent'):
   return output
 
 
+def parse_columns(lines, fields, tab=False):
+  """Parse the given (1-based) fields of every line at once, into a 2D numpy array of floats with
+  one column per field.
+  This is much faster than going line by line, but it's all or nothing: if any line is missing a
+  field or has a non-number (including "inf" and "nan"), it returns None. The caller can then fall
+  back to get_fields(), which can skip or warn about the bad lines individually.
+  Requires numpy. Uses pandas' C parser instead of numpy.loadtxt(), if pandas is installed."""
+  import numpy
+  if not lines:
+    return numpy.empty((0, len(fields)))
+  usecols = [field-1 for field in fields]
+  data = _parse_columns_pandas(io.StringIO(''.join(lines)), usecols, tab)
+  if data is None:
+    data = _parse_columns_numpy(lines, usecols, tab)
+    if data is None:
+      return None
+  # Both parsers silently skip blank lines, but get_fields() would warn about them.
+  if len(data) != len(lines) or not numpy.all(numpy.isfinite(data)):
+    return None
+  return data
+
+
+def parse_str_columns(lines, fields, str_fields, tab=False):
+  """Like parse_columns(), but also pull out the "str_fields" of every line, as strings.
+  Returns the 2D array of floats for "fields", and a list with a 1D numpy array of strs for each of
+  the "str_fields". Returns None if the input can't be parsed this way: the rules are the same as
+  parse_columns(), and every line must have all the str fields, too.
+  Requires numpy. Uses pandas' C parser instead of numpy.loadtxt(), if pandas is installed."""
+  import numpy
+  if not lines:
+    return numpy.empty((0, len(fields))), [numpy.empty(0, dtype=str) for field in str_fields]
+  num_cols = [field-1 for field in fields]
+  str_cols = [field-1 for field in str_fields]
+  if set(num_cols) & set(str_cols):
+    return None
+  usecols = num_cols + str_cols
+  dtypes = dict.fromkeys(num_cols, 'float64')
+  dtypes.update(dict.fromkeys(str_cols, str))
+  table = _read_table_pandas(io.StringIO(''.join(lines)), usecols, tab, dtype=dtypes,
+                             na_filter=False)
+  if table is not None:
+    data = table[num_cols].to_numpy()
+    strs = [table[col].to_numpy() for col in str_cols]
+    # pandas reads missing fields as empty strings, so let the caller sort out any empty ones.
+    for column in strs:
+      if numpy.any(column == ''):
+        return None
+    if len(data) != len(lines) or not numpy.all(numpy.isfinite(data)):
+      return None
+    return data, strs
+  table = _parse_columns_numpy(lines, usecols, tab, dtype=str)
+  if table is None:
+    return None
+  try:
+    data = table[:,:len(fields)].astype(float)
+  except ValueError:
+    return None
+  if len(data) != len(lines) or not numpy.all(numpy.isfinite(data)):
+    return None
+  return data, [table[:,i] for i in range(len(fields), len(usecols))]
+
+
+def parse_file_columns(input, fields, tab=False):
+  """Like parse_columns(), but parse a file on disk directly instead of a list of lines. The file is
+  memory-mapped, which avoids reading it all into Python strings first.
+  This requires pandas, and only works on regular files. Returns None if it can't be used, or if the
+  file can't be parsed this way (same rules as parse_columns()). Doesn't move the file position."""
+  # Check for pandas first, so the file isn't mapped and its lines counted for nothing.
+  try:
+    import pandas
+  except ImportError:
+    return None
+  import mmap
+  import numpy
+  try:
+    fileno = input.fileno()
+    # pandas needs the path. Make sure the name really is one (the name of a file opened from a
+    # descriptor is an int, and sys.stdin's is "<stdin>").
+    if not isinstance(input.name, str):
+      return None
+    file_stat = os.fstat(fileno)
+    if not stat.S_ISREG(file_stat.st_mode) or input.tell() != 0:
+      return None
+    if not os.path.samestat(file_stat, os.stat(input.name)):
+      return None
+    mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+  except (AttributeError, OSError, ValueError):
+    # Not a real file, or an empty one (which can't be mapped).
+    return None
+  with mapped:
+    # Count the lines, to check that none were skipped.
+    num_lines = _count_lines(mapped)
+    usecols = [field-1 for field in fields]
+    data = _parse_columns_pandas(input.name, usecols, tab, encoding=input.encoding,
+                                 memory_map=True)
+  if data is None or len(data) != num_lines or not numpy.all(numpy.isfinite(data)):
+    return None
+  return data
+
+
+def parse_bytes_columns(data_bytes, fields, tab=False, encoding=None):
+  """Like parse_columns(), but parse the raw, undecoded contents of a file or stream. This avoids
+  decoding and splitting it into a Python str per line first.
+  This requires pandas. Returns None if it's not available, or if the input can't be parsed this way
+  (same rules as parse_columns())."""
+  import numpy
+  if not data_bytes:
+    return numpy.empty((0, len(fields)))
+  usecols = [field-1 for field in fields]
+  data = _parse_columns_pandas(io.BytesIO(data_bytes), usecols, tab, encoding=encoding)
+  if data is None or len(data) != _count_lines(data_bytes) or not numpy.all(numpy.isfinite(data)):
+    return None
+  return data
+
+
+def _count_lines(buffer):
+  """Count the lines in a non-empty bytes-like object, including a last one with no newline."""
+  import numpy
+  chars = numpy.frombuffer(buffer, dtype=numpy.uint8)
+  num_lines = numpy.count_nonzero(chars == ord('\n'))
+  if chars[-1] != ord('\n'):
+    num_lines += 1
+  return num_lines
+
+
+def _parse_columns_numpy(lines, usecols, tab, **kwargs):
+  """Parse the usecols with numpy.loadtxt(). Returns None if it couldn't parse the lines.
+  numpy's warnings (like the one for blank lines) count as failures too, so they aren't printed and
+  the caller's line-by-line fallback can warn about those lines itself."""
+  import numpy
+  if tab:
+    delimiter = '\t'
+  else:
+    delimiter = None
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    try:
+      return numpy.loadtxt(lines, delimiter=delimiter, comments=None, usecols=usecols, ndmin=2,
+                           **kwargs)
+    except (ValueError, IndexError, UserWarning):
+      return None
+
+
+def _parse_columns_pandas(source, usecols, tab, **kwargs):
+  """Returns None if pandas isn't available or couldn't parse the input."""
+  table = _read_table_pandas(source, usecols, tab, dtype='float64', **kwargs)
+  if table is None:
+    return None
+  # read_csv() orders the columns by index, not by the order in usecols.
+  return table[usecols].to_numpy()
+
+
+def _read_table_pandas(source, usecols, tab, **kwargs):
+  """Read the usecols into a pandas DataFrame with the C parser.
+  Returns None if pandas isn't available or couldn't parse the input."""
+  try:
+    import pandas
+  except ImportError:
+    return None
+  # pandas doesn't support negative column indices.
+  if min(usecols) < 0:
+    return None
+  if tab:
+    sep = '\t'
+  else:
+    sep = r'\s+'
+  try:
+    return pandas.read_csv(source, sep=sep, header=None, index_col=False, usecols=usecols,
+                           quoting=csv.QUOTE_NONE, engine='c', **kwargs)
+  except (ValueError, IndexError):
+    return None
+
+
 def deindex_or_error(values, index, errors, line=None):
   """Pull a value from a list of fields, handling errors as requested."""
   try:
@@ -93,12 +276,23 @@ def to_num(num_str):
   """Parse a string into an int, if possible, or a float, failing that.
   If it cannot be parsed as a float, a ValueError will be thrown.
   The float values "inf" and "nan" are not counted as valid, and will
-  raise a ValueError."""
-  try:
-    return int(num_str)
-  except ValueError:
-    num = float(num_str)
-    if num in NON_NUMBERS:
-      raise ValueError('"inf" and "nan" are not counted as valid numbers')
-    else:
+  raise a ValueError.
+  Uses fastnumbers, if it's installed."""
+  if try_real is not None and num_str.isascii():
+    # Anything fastnumbers rejects goes through the normal path below, so edge cases (like
+    # underscores) still behave exactly the same.
+    num = try_real(num_str, inf=None, nan=None, on_fail=None, coerce=False)
+    if isinstance(num, int) or (isinstance(num, float) and math.isfinite(num)):
       return num
+  # Only try int() on strings that could be ints, so that every float doesn't raise an exception.
+  digits = num_str.strip().lstrip('+-')
+  if digits.isdigit() or '_' in digits:
+    try:
+      return int(num_str)
+    except ValueError:
+      pass
+  num = float(num_str)
+  if num in NON_NUMBERS:
+    raise ValueError('"inf" and "nan" are not counted as valid numbers')
+  else:
+    return num
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
+import io
 import sys
 import time
 import math
+import array
 import logging
 import argparse
 import datetime
+import itertools
+import numpy
 import matplotliblib
 import munger
 from utillib import datelib
@@ -14,7 +18,7 @@ OPT_DEFAULTS = {'x_label':'X Value', 'y_label':'Y Value'}
 USAGE = """cat file.txt | %(prog)s [options]
        %(prog)s [options] file.txt"""
 DESCRIPTION = """Display a quick scatterplot of the input data, using matplotlib."""
-EPILOG = """Caution: It holds the entire dataset in memory, as a list."""
+EPILOG = """Caution: It holds the entire dataset in memory."""
 
 
 def make_parser():
@@ -117,8 +121,12 @@ def main(argv):
   plotter.add_arguments(parser, groups)
   args = parser.parse_args(argv[1:])
 
-  logging.basicConfig(stream=args.log, level=args.volume, format='%(message)s')
+  logging.basicConfig(filename=args.log, filemode='w', level=args.volume, format='%(message)s')
 
+  if args.head is not None and args.head < 0:
+    fail('Error: --head must not be negative.')
+  if args.tail is not None and args.tail < 0:
+    fail('Error: --tail must not be negative.')
   if args.tag_field is not None and args.tail is not None:
     fail('Error: --tail is not yet supported at the same time as --tag-field.')
 
@@ -148,14 +156,10 @@ def main(argv):
   fields = {'1':args.field, 'x':args.x_field, 'y':args.y_field, 'tag':args.tag_field,
             'label':args.label_field, 'time':time_field}
   x, y, labels = read_data(args.input, fields, args.tab, args.time_disp, args.time_unit, args.head,
-                           start, end)
+                           args.tail, start, end)
   if args.input is not sys.stdin:
     args.input.close()
 
-  if args.tail is not None:
-    x = x[-args.tail:]
-    y = y[-args.tail:]
-
   # Postprocess some of the data for multiplots.
   if args.tag_field:
     if args.changing_only:
@@ -186,13 +190,15 @@ def main(argv):
       xbins = args.x_bins
     if args.y_bins:
       ybins = args.y_bins
+    if xbins < 2 or ybins < 2:
+      fail('Error: --heatmap needs at least 2 bins on each axis.')
     heatmap, extents = get_heatmap_counts(x, y, xbins, ybins)
     logging.debug('extents: xmin: {0}, xmax: {1}, ymin: {2}, ymax: {3}'.format(*extents))
     if args.log_scale:
-      log_transform_heatmap(heatmap, args.log0)
+      heatmap = log_transform_heatmap(heatmap, args.log0)
 
   # Create the Axes object.
-  axes = plotter.preplot(**vars(args))
+  axes = plotter.preplot(args)
 
   # Plot the data.
   if args.heatmap:
@@ -232,139 +238,368 @@ def main(argv):
     set_time_ticks(plotter, x, y, multiplot, args.unix_time, args.time_disp, time_field, args.date_ticks)
 
   # Do final adjustments and show the plot.
-  plotter.plot(**vars(args))
+  plotter.plot(args)
+
+
+def read_data(input, fields, tab, time_disp, time_unit, head, tail, start, end):
+  now = int(time.time())
+  if head is not None:
+    # Only the first lines will be plotted, so don't read (or parse) any past them.
+    input = itertools.islice(input, head)
+  # Try parsing everything at once first, and only go line by line if the input is irregular.
+  if fields['1'] is None:
+    columns = (fields['x'], fields['y'])
+  else:
+    columns = (fields['1'],)
+  if fields['tag'] is None:
+    data = None
+    if head is None:
+      data = munger.parse_file_columns(input, columns, tab)
+      if data is None and hasattr(input, 'buffer'):
+        # Pipes can't be memory-mapped, but the raw bytes can still be parsed without decoding them.
+        raw = input.buffer.read()
+        data = munger.parse_bytes_columns(raw, columns, tab, encoding=input.encoding)
+        input = io.TextIOWrapper(io.BytesIO(raw), encoding=input.encoding)
+    if data is None:
+      input = list(input)
+      data = munger.parse_columns(input, columns, tab)
+    if data is not None:
+      x, y = get_points(data, fields, time_disp, time_unit, now, start, end)
+      if tail is not None:
+        # Copy the last points, so the rest of the parsed data can be freed.
+        tail_start = max(len(x) - tail, 0)
+        x = x[tail_start:].copy()
+        y = y[tail_start:].copy()
+      return x, y, None
+  else:
+    # The tags (and labels) are strings, so they have to be pulled out separately.
+    input = list(input)
+    str_fields = [fields['tag']]
+    if fields['label'] is not None:
+      str_fields.append(fields['label'])
+    parsed = munger.parse_str_columns(input, columns, str_fields, tab)
+    if parsed is not None:
+      data, str_columns = parsed
+      x, y, *str_columns = get_points(data, fields, time_disp, time_unit, now, start, end,
+                                      str_columns)
+      return get_serieses(x, y, *str_columns)
+  return read_data_lines(input, fields, tab, time_disp, time_unit, tail, start, end, now)
+
+
+def get_points(data, fields, time_disp, time_unit, now, start, end, extra_columns=()):
+  """Do the same time filtering and conversion as read_data_lines(), but on whole columns at once.
+  "data" is the 2D array from munger.parse_columns(), with the x column and then the y column (or
+  just the x column, for 1-dimensional data).
+  Any "extra_columns" (arrays with a value for each row of "data") are filtered along with the
+  points, and returned after x and y."""
+  x = data[:,0]
+  if fields['1'] is None:
+    y = data[:,1]
+  else:
+    y = numpy.ones(len(x))
+  # Whether x and y are new arrays, rather than views of "data".
+  copied = False
+  if fields['time']:
+    if fields['time'] == 'x':
+      timestamps = x
+    elif fields['time'] == 'y':
+      timestamps = y
+    if start is not None or end is not None:
+      in_range = numpy.ones(len(timestamps), dtype=bool)
+      if start is not None:
+        in_range &= timestamps >= start
+      if end is not None:
+        in_range &= timestamps <= end
+      x = x[in_range]
+      y = y[in_range]
+      extra_columns = [column[in_range] for column in extra_columns]
+      copied = True
+    # If filtering already copied the timestamps, convert that copy instead of making another.
+    if time_disp == 'ago':
+      if fields['time'] == 'x':
+        x = get_time_ago(x, time_unit, now, in_place=copied)
+      elif fields['time'] == 'y':
+        y = get_time_ago(y, time_unit, now, in_place=copied)
+  return (x, y, *extra_columns)
+
+
+def get_serieses(x, y, tags, labels=None):
+  """Split whole columns of points into multiple data series, by their tags. Returns the same
+  (x_serieses, y_serieses, labels) as read_data_lines(): the series are in order of the first
+  appearance of their tags, and each one's label is the one from its first point."""
+  unique_tags, first_indices, series_nums = numpy.unique(tags, return_index=True,
+                                                         return_inverse=True)
+  # numpy.unique() sorts the tags, so renumber the series in order of appearance.
+  order = numpy.argsort(first_indices)
+  renumbering = numpy.empty(len(order), dtype=numpy.intc)
+  renumbering[order] = numpy.arange(len(order))
+  tags_list = unique_tags[order].tolist()
+  if labels is None:
+    labels_dict = dict.fromkeys(tags_list)
+  else:
+    labels_dict = dict(zip(tags_list, labels[first_indices[order]].tolist()))
+  x_serieses, y_serieses = split_series(x, y, renumbering[series_nums], tags_list)
+  return x_serieses, y_serieses, labels_dict
+
+
+def get_time_ago(timestamps, time_unit, now, in_place=False):
+  """Convert an array of timestamps into how long before "now" they are, in "time_unit"s.
+  With "in_place", overwrite and return the "timestamps" array itself."""
+  # Scale the difference in place, to allocate one new array at most. Multiplying by the reciprocal
+  # is faster than dividing.
+  if in_place:
+    ago = timestamps
+    ago -= now
+  else:
+    ago = timestamps - now
+  ago *= 1 / time_unit.seconds
+  return ago
 
 
-def read_data(input, fields, tab, time_disp, time_unit, head, start, end):
+def read_data_lines(input, fields, tab, time_disp, time_unit, tail, start, end, now):
   # read data into lists, parse types into ints or skipping if not possible
   if fields['1'] is None:
     field_columns = (fields['x'], fields['y'], fields['tag'], fields['label'])
     casts = (True, True, False, False)
   labels = {}
-  now = int(time.time())
   #TODO: Get and return the xmaxes and ymaxes while reading the input.
-  x_serieses = {}
-  y_serieses = {}
-  x = []
-  y = []
-  line_num = 0
-  for line in input:
-    line_num+=1
-    if fields['1'] is not None:
-      xval = munger.get_field(line, field=fields['1'], tab=tab, cast=True, errors='warn')
-      yval = 1
+  # Collect the points in packed arrays of doubles, so they can become numpy arrays without a copy.
+  # Multiple data series go in the same arrays, with the number of each point's series (in order of
+  # appearance) in series_nums. They're split up at the end.
+  x = array.array('d')
+  y = array.array('d')
+  series_nums = array.array('i')
+  tag_nums = {}
+  # Work out everything that's the same for every line up front, so the loop only has to check flags.
+  one_dim = fields['1'] is not None
+  multiplot = fields['tag'] is not None
+  time_field = fields['time']
+  time_is_x = time_field == 'x'
+  filter_time = time_field and (start is not None or end is not None)
+  # Bind these to locals to avoid the global and attribute lookups on every line.
+  get_field = munger.get_field
+  get_fields = munger.get_fields
+  to_num = munger.to_num
+  field = fields['1']
+  x_append = x.append
+  y_append = y.append
+  series_append = series_nums.append
+  if one_dim:
+    x_index = field - 1
+  else:
+    x_index = fields['x'] - 1
+    y_index = fields['y'] - 1
+  if multiplot:
+    tag_index = fields['tag'] - 1
+  label_index = None
+  if fields['label'] is not None:
+    label_index = fields['label'] - 1
+  # If only some of the lines are in the --start/--end range, check their timestamps before
+  # parsing anything else. (With 1-dimensional data, the y "timestamps" are all the constant 1.)
+  early_filter = filter_time and (time_is_x or not one_dim)
+  if early_filter:
+    if time_is_x:
+      time_index = x_index
     else:
-      xval, yval, tag, label = munger.get_fields(line, fields=field_columns, tab=tab, casts=casts,
-                                          errors='warn')
-    if xval is None or yval is None:
-      continue
-    if head is not None and line_num > head:
-      break
+      time_index = y_index
+  if tab:
+    sep = '\t'
+  else:
+    sep = None
+  # Stop splitting after the last column we need, unless one counts from the end of the line.
+  used_indices = [x_index]
+  if not one_dim:
+    used_indices.append(y_index)
+  if multiplot:
+    used_indices.append(tag_index)
+  if label_index is not None:
+    used_indices.append(label_index)
+  if min(used_indices) >= 0:
+    maxsplit = max(used_indices) + 1
+  else:
+    maxsplit = -1
+  # With --tail (which isn't allowed with multiple data series), only the last points are kept.
+  # Let the arrays grow to twice that, then drop the older half, so it only takes O(tail) memory.
+  if tail is None:
+    trim_at = None
+  else:
+    trim_at = max(2*tail, 1024)
+  label = None
+  for line in input:
+    # Parse the common case inline. Only lines with problems go through munger, to get the warning.
+    try:
+      values = line.strip('\r\n').split(sep, maxsplit)
+      if early_filter:
+        timestamp = to_num(values[time_index])
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+          continue
+      xval = to_num(values[x_index])
+      if one_dim:
+        yval = 1
+      else:
+        yval = to_num(values[y_index])
+        if multiplot:
+          tag = values[tag_index]
+          if label_index is not None:
+            label = values[label_index]
+    except (IndexError, ValueError):
+      if one_dim:
+        xval = get_field(line, field=field, tab=tab, cast=True, errors='warn')
+        yval = 1
+      else:
+        xval, yval, tag, label = get_fields(line, fields=field_columns, tab=tab, casts=casts,
+                                            errors='warn')
+      if xval is None or yval is None:
+        continue
     # Timestamp stuff.
-    if fields['time']:
-      if fields['time'] == 'x':
+    if filter_time:
+      if time_is_x:
         timestamp = xval
-      elif fields['time'] == 'y':
+      else:
         timestamp = yval
       if start is not None and timestamp < start:
         continue
       elif end is not None and timestamp > end:
         continue
-      if time_disp == 'ago':
-        if fields['time'] == 'x':
-          xval = (xval - now) / time_unit.seconds
-        elif fields['time'] == 'y':
-          yval = (yval - now) / time_unit.seconds
-    if fields['tag'] is None:
-      x.append(xval)
-      y.append(yval)
-    else:
+    x_append(xval)
+    # 1-dimensional data gets its constant y values all at once, at the end.
+    if not one_dim:
+      y_append(yval)
+    if trim_at is not None and len(x) >= trim_at:
+      del x[:len(x)-tail]
+      del y[:len(y)-tail]
+    if multiplot:
       # Multiple data series stuff.
-      if tag not in x_serieses:
-        x_serieses[tag] = []
-        y_serieses[tag] = []
+      tag_num = tag_nums.get(tag)
+      if tag_num is None:
+        tag_num = tag_nums[tag] = len(tag_nums)
         labels[tag] = label
-      x_serieses[tag].append(xval)
-      y_serieses[tag].append(yval)
-  if fields['tag'] is None:
-    return x, y, None
+      series_append(tag_num)
+  if tail is not None:
+    del x[:max(len(x)-tail, 0)]
+    del y[:max(len(y)-tail, 0)]
+  x = numpy.frombuffer(x)
+  if one_dim:
+    y = numpy.ones(len(x))
   else:
+    y = numpy.frombuffer(y)
+  # Convert the timestamps all at once, now that they're in arrays.
+  if time_field and time_disp == 'ago':
+    # The arrays are our own buffers, so they can be converted in place.
+    if time_is_x:
+      x = get_time_ago(x, time_unit, now, in_place=True)
+    else:
+      y = get_time_ago(y, time_unit, now, in_place=True)
+  if multiplot:
+    series_nums = numpy.frombuffer(series_nums, dtype=numpy.intc)
+    x_serieses, y_serieses = split_series(x, y, series_nums, list(tag_nums))
     return x_serieses, y_serieses, labels
+  else:
+    return x, y, None
+
+
+def split_series(x, y, series_nums, tags):
+  """Split the points of several data series into a dict of x arrays and a dict of y arrays, keyed
+  by tag. "series_nums" gives the index (in "tags") of the series each point belongs to."""
+  # Sort the points by series, keeping them in their original order within each series.
+  order = numpy.argsort(series_nums, kind='stable')
+  bounds = numpy.searchsorted(series_nums[order], numpy.arange(len(tags)+1))
+  x_sorted = x[order]
+  y_sorted = y[order]
+  x_serieses = {}
+  y_serieses = {}
+  for i, tag in enumerate(tags):
+    x_serieses[tag] = x_sorted[bounds[i]:bounds[i+1]]
+    y_serieses[tag] = y_sorted[bounds[i]:bounds[i+1]]
+  return x_serieses, y_serieses
 
 
 def trim_static_series(x_serieses, y_serieses):
   tags = list(y_serieses.keys())
   for tag in tags:
-    changed = False
-    y_series = y_serieses[tag]
-    first = y_series[0]
-    for val in y_series:
-      if val != first:
-        changed = True
-        break
-    if not changed:
+    y_series = numpy.asarray(y_serieses[tag])
+    if y_series.min() == y_series.max():
       logging.info('No variation in series {!r}. Skipping..'.format(tag))
       del x_serieses[tag]
       del y_serieses[tag]
 
 
 def normalize(x_serieses, y_serieses):
-  y_serieses_new = {}
   for tag, y_series in y_serieses.items():
-    ymax = max(y_series)
-    ymin = min(y_series)
+    # A view of the series, so dividing it changes the series in place.
+    y_values = numpy.asarray(y_series)
     # Divide all values by the one furthest from 0.
-    factor = max(ymax, abs(ymin))
+    factor = max(y_values.max(), abs(y_values.min()))
     if factor == 0:
       # If all the values are 0, just leave them as 0's.
       factor = 1
-    for i, yval in enumerate(y_series):
-      y_series[i] = yval/factor
+    y_values /= factor
 
 
 def get_heatmap_counts(x, y, xbins, ybins):
-  # Initialize the heatmap counts.
-  heatmap = []
-  for ybin in range(ybins):
-    heatmap.append([0] * xbins)
+  x = numpy.asarray(x)
+  y = numpy.asarray(y)
   # Get the min/max data values.
-  xmin = min(x)
-  xmax = max(x)
-  ymin = min(y)
-  ymax = max(y)
+  xmin = float(x.min())
+  xmax = float(x.max())
+  ymin = float(y.min())
+  ymax = float(y.max())
+  # If all the values on an axis are the same, there's no width to divide into bins. Widen the range
+  # by 0.5 on each side, like numpy.histogram() does.
+  if xmin == xmax:
+    xmin -= 0.5
+    xmax += 0.5
+  if ymin == ymax:
+    ymin -= 0.5
+    ymax += 0.5
   # Make the first bin centered on the minimum value and the last bin centered on the maximum one.
   xbin_width = (xmax - xmin) / (xbins-1)
   xleft_edge = xmin - xbin_width/2
   ybin_height = (ymax - ymin) / (ybins-1)
   ybottom_edge = ymin - ybin_height/2
-  for xval, yval in zip(x, y):
-    # bins are half-open: [bin_min, bin_max).
-    xbin = int((xval - xleft_edge) / xbin_width)
-    ybin = int((yval - ybottom_edge) / ybin_height)
-    heatmap[ybin][xbin] += 1
+  xbin_nums = get_bin_nums(x, xleft_edge, xbin_width, xbins)
+  ybin_nums = get_bin_nums(y, ybottom_edge, ybin_height, ybins)
+  # Count all the bins at once by numbering them row by row, like a flattened heatmap. That gives
+  # one contiguous (ybins, xbins) array of counts, which imshow() can use as is.
+  counts = numpy.bincount(ybin_nums*xbins + xbin_nums, minlength=xbins*ybins)
+  heatmap = counts.reshape(ybins, xbins)
   return heatmap, (xmin, xmax, ymin, ymax)
 
 
+def get_bin_nums(values, left_edge, bin_width, bins):
+  """Find which of a row of equal-width "bins" each value falls in, directly from the bin width
+  instead of searching the bin edges. Returns an array of bin indices."""
+  # bins are half-open: [bin_min, bin_max). The values are all above the left edge, so truncating
+  # is the same as flooring. Clip in case rounding pushes the maximum value past the last bin.
+  bin_nums = ((values - left_edge) / bin_width).astype(numpy.intp)
+  numpy.clip(bin_nums, 0, bins-1, out=bin_nums)
+  return bin_nums
+
+
 def format_heatmap_counts_debug(heatmap):
-  """Create an ascii matrix of heatmap counts.
+  """Create an ascii matrix of heatmap counts (a 2D array, as from get_heatmap_counts()).
   Returns a series of lines (no newlines), ready to be printed."""
   out_lines = []
-  max_val = max([max(row) for row in heatmap])
+  max_val = heatmap.max()
   fwidth = int(math.log10(max_val)+1)
   fmt_str = '{:'+str(fwidth)+'d}'
-  for row in reversed(heatmap):
-    for i in range(len(row)):
-      out_lines.append(' '.join([fmt_str.format(val) for val in row]))
+  for row in heatmap[::-1]:
+    out_lines.append(' '.join([fmt_str.format(val) for val in row]))
   return out_lines
 
 
 def log_transform_heatmap(heatmap, zero_offset=False):
-  for row in heatmap:
-    for i in range(len(row)):
-      if zero_offset:
-        row[i] = math.log10(row[i]+0.1)+1
-      else:
-        row[i] = math.log10(row[i])
+  """Return the log10 of the heatmap counts, as a new array of floats.
+  Without "zero_offset", empty bins come out as -inf, which imshow() leaves blank."""
+  logs = heatmap.astype(float)
+  if zero_offset:
+    logs += 0.1
+    numpy.log10(logs, out=logs)
+    logs += 1
+  else:
+    with numpy.errstate(divide='ignore'):
+      numpy.log10(logs, out=logs)
+  return logs
 
 
 def set_time_ticks(plotter, x, y, multiplot, unix_time, time_disp, time_field, date_ticks):
@@ -399,21 +634,15 @@ def get_tick_params(x, y, multiplot, unix_time, time_disp, time_field, date_tick
 
 
 def get_min_max(data, multiplot):
-  min_val = None
-  max_val = None
   if multiplot:
-    for series in data.values():
-      series_min = min(series)
-      series_max = max(series)
-      if min_val is None:
-        min_val = series_min
-        max_val = series_max
-      else:
-        min_val = min(min_val, series_min)
-        max_val = max(max_val, series_max)
+    # Empty series have no min or max, so leave them out.
+    serieses = [numpy.asarray(series) for series in data.values() if len(series) > 0]
+    min_val = min(series.min() for series in serieses)
+    max_val = max(series.max() for series in serieses)
   else:
-    min_val = min(data)
-    max_val = max(data)
+    values = numpy.asarray(data)
+    min_val = values.min()
+    max_val = values.max()
   return min_val, max_val
 
 
@@ -427,14 +656,14 @@ def get_time_ticks(time_min, time_max, min_ticks=5, max_ticks=15):
   tick_labels = []
   tick_dt = first_tick_dt
   tick_value = first_tick_value
+  format_str = time_unit.format_rounded.replace(' ', '\n')
   while tick_value < time_max:
     #TODO: Abbreviate labels so that we don't keep repeating the same year/month/day/hour/etc.
     #      E.g. If the time period is a few hours, list "2015-05-10 20:00" for the first tick, then
     #      just "21:00" for the next one, and only show the date again when it changes
     #      ("2015-05-11 00:00").
     tick_values.append(tick_value)
-    tick_label = tick_dt.strftime(time_unit.format_rounded.replace(' ', '\n'))
-    tick_labels.append(tick_label)
+    tick_labels.append(tick_dt.strftime(format_str))
     tick_dt = datelib.increase_datetime(tick_dt, time_unit, multiple)
     tick_value = int(tick_dt.timestamp())
   return tick_values, tick_labels
@@ -20,3 +20,28 @@ else
   echo "Output does not match scatterplot1.png.out"
 fi
 rm scatterplot-tmp.png
+
+echo -e "\tscatterplot.py ::: heatmap with a constant x axis:"
+errors=$(printf '1\t2\n1\t3\n1\t4\n' | ../scatterplot.py -t -M -o scatterplot-tmp.png 2>&1)
+if [[ $? == 0 ]] && [[ -s scatterplot-tmp.png ]] && [[ -z "$errors" ]]; then
+  echo "Plotted without errors or warnings"
+else
+  echo "Failed to plot cleanly: $errors"
+fi
+rm -f scatterplot-tmp.png
+
+echo -e "\thistoplot.py ::: histoplot.txt.in --print-counts:"
+if ../histoplot.py --print-counts -R 1 3 histoplot.txt.in | diff -q - histoplot-R1-3.tsv.out >/dev/null; then
+  echo "Output is identical to histoplot-R1-3.tsv.out"
+else
+  echo "Output does not match histoplot-R1-3.tsv.out"
+fi
+
+echo -e "\thistoplot.py ::: histoplot.txt.in -o .csv:"
+../histoplot.py -b 8 histoplot.txt.in -o histoplot-tmp.csv
+if diff -q histoplot-tmp.csv histoplot-b8.csv.out >/dev/null; then
+  echo "Output is identical to histoplot-b8.csv.out"
+else
+  echo "Output does not match histoplot-b8.csv.out"
+fi
+rm -f histoplot-tmp.csv